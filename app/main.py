@@ -1,6 +1,10 @@
+import asyncio
 import os
 from dotenv import load_dotenv
-from typing import Callable, List
+from typing import List
+import hashlib
+import math
+import orjson
 import time
 
 from fastapi import (
@@ -14,127 +18,189 @@ from fastapi import (
     status,
     Security,
 )
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse, Response
 from fastapi.security import OAuth2PasswordBearer
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.middleware.sessions import SessionMiddleware
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from starlette.websockets import WebSocketState
 
 from contextlib import asynccontextmanager
 from loguru import logger
 
-from tortoise import Tortoise
 from tortoise.exceptions import DoesNotExist
 
+from app.modules.cache import INVALID_TOKEN_TTL, invalid_token_cache, token_cache
 from app.modules.env import ENV
+from app.modules.database import database_connect, database_close
 from app.modules.database_models import UsersInfo
+from app.modules.log import log_close, log_setup
+from app.modules.rate_limit import rate_limit_close, rate_limit_connect, take_token
 from app.modules.tusserver.metadata import FileMetadata
 from app.modules.tusserver.tus import create_api_router
 from app.modules.user_manager import UserManager
-from app.modules.file_storage import FileStorage
+from app.modules.file_storage import FILE_SIZE_LIMIT, fsync_close, get_file_storage
 
 
 load_dotenv()
 
-# Rate limiting configuration
-rate_limit_dict = {}
+# liveness probes, neither rate limited nor logged
+UNMETERED_PATHS = frozenset({"/health"})
 
 
-class RateLimitMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next: Callable):
-        # Get client IP
-        client_ip = request.client.host if request.client else "unknown"
-        current_time = time.time()
-
-        # Clean up old entries
-        rate_limit_dict.clear()
-
-        # Check rate limit
-        if client_ip in rate_limit_dict:
-            requests = rate_limit_dict[client_ip]
-            if len(requests) >= ENV.REQUEST_TIMES_PER_MINTUE:
-                oldest_request = requests[0]
-                if current_time - oldest_request < 60:  # Within 1 minute
-                    return JSONResponse(
-                        status_code=429, content={"error": "Too many requests"}
-                    )
-                requests.pop(0)
-        else:
-            rate_limit_dict[client_ip] = []
-
-        rate_limit_dict[client_ip].append(current_time)
-        return await call_next(request)
+class RateLimitMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
 
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["path"] in UNMETERED_PATHS:
+            return await self.app(scope, receive, send)
 
-class RequestLoggingMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next: Callable):
-        start_time = time.time()
-        response = await call_next(request)
-        process_time = time.time() - start_time
+        # Get client IP
+        client = scope.get("client")
+        client_ip = client[0] if client else "unknown"
+        retry_after = await take_token(client_ip)
+        if retry_after:
+            response = ORJSONResponse(
+                status_code=429,
+                content={"error": "Too many requests"},
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+            return await response(scope, receive, send)
+        await self.app(scope, receive, send)
+
+
+class RequestLoggingMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["path"] in UNMETERED_PATHS:
+            return await self.app(scope, receive, send)
+
+        start_time = time.monotonic_ns()
+        status_code = None
+
+        async def logging_send(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        await self.app(scope, receive, logging_send)
+        process_time = (time.monotonic_ns() - start_time) / 1_000_000_000
         logger.info(
-            f"{request.method} {request.url.path} "
-            f"Status: {response.status_code} "
+            f"{scope['method']} {scope['path']} "
+            f"Status: {status_code} "
             f"Duration: {process_time:.3f}s"
         )
-        return response
 
 
-if not ENV.ALLOWED_USERS:
-    logger.error("ALLOWED_USERS is empty, please set it in .env file")
-    exit(1)
+# room for the multipart boundary and part headers around a single file
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class MaxBodySizeMiddleware:
+    """Rejects request bodies above REQUEST_SIZE_LIMIT_MB before the handler
+    (and multipart parsing) spools them to memory or disk. Single-file
+    /upload is held to the per-file limit instead."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.default_max_size = ENV.REQUEST_SIZE_LIMIT_MB * 1024 * 1024
+        self.path_max_sizes = {"/upload": FILE_SIZE_LIMIT + MULTIPART_OVERHEAD}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        max_size = self.path_max_sizes.get(scope["path"], self.default_max_size)
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length and int(content_length) > max_size:
+            response = ORJSONResponse(
+                {"error": "Request body too large"}, status_code=413
+            )
+            return await response(scope, receive, send)
+
+        # Content-Length can be missing (chunked) or wrong, so count the bytes
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_size:
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail="Request body too large",
+                    )
+            return message
 
+        await self.app(scope, limited_receive, send)
 
-async def database_connect():
-    # Configure database with connection pooling
-    await Tortoise.init(
-        db_url=ENV.DATABASE_URL,
-        modules={"models": ["app.modules.database_models"]},
-        _create_db=True,
-    )
-    await Tortoise.generate_schemas()
+
+# encoded once, appended to every response start
+SECURITY_HEADERS = [
+    (b"x-content-type-options", b"nosniff"),
+    (b"x-frame-options", b"DENY"),
+    (b"x-xss-protection", b"1; mode=block"),
+    (b"strict-transport-security", b"max-age=31536000; includeSubDomains"),
+]
 
 
-async def database_close():
-    await Tortoise.close_connections()
+class SecurityHeadersMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        async def send_with_headers(message: Message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), *SECURITY_HEADERS]
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+
+if not ENV.ALLOWED_USERS:
+    logger.error("ALLOWED_USERS is empty, please set it in .env file")
+    exit(1)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     os.makedirs(ENV.BASE_FOLDER, exist_ok=True)
+    log_setup()
     try:
         await database_connect()
+        await rate_limit_connect()
         yield
     except Exception as e:
         logger.error(f"Error connecting to database: {e}")
         raise  # Re-raise the exception to halt startup
     finally:
+        await fsync_close()
+        await rate_limit_close()
         await database_close()
         logger.info("Shutting down...")
+        log_close()
 
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 
-# Add security headers middleware
-@app.middleware("http")
-async def add_security_headers(request: Request, call_next):
-    response = await call_next(request)
-    response.headers["X-Content-Type-Options"] = "nosniff"
-    response.headers["X-Frame-Options"] = "DENY"
-    response.headers["X-XSS-Protection"] = "1; mode=block"
-    response.headers["Strict-Transport-Security"] = (
-        "max-age=31536000; includeSubDomains"
-    )
-    return response
-
-
-# Add middlewares
+# Add middlewares; the last one added runs first, so a rate-limited request is
+# turned away (with CORS headers) before logging, gzip or body checks run
+app.add_middleware(SecurityHeadersMiddleware)
+app.add_middleware(MaxBodySizeMiddleware)
+app.add_middleware(GZipMiddleware, minimum_size=1000)
 app.add_middleware(RequestLoggingMiddleware)
 app.add_middleware(RateLimitMiddleware)
-app.add_middleware(GZipMiddleware, minimum_size=1000)
-app.add_middleware(SessionMiddleware, secret_key=ENV.SECRET_KEY)
 
 # Configure CORS with more specific settings
 app.add_middleware(
@@ -174,9 +240,19 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
 async def api_token_auth(token: str) -> UsersInfo:
+    user = token_cache.get(token)
+    if user is not None:
+        return user
+    token_key = hashlib.sha256(token.encode()).hexdigest()[:32]
+    expires = invalid_token_cache.get(token_key)
+    if expires is not None and expires > time.monotonic():
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Token"
+        )
     try:
-        return await UsersInfo.get(token=token)
+        user = await UsersInfo.get(token=token)
     except DoesNotExist:
+        invalid_token_cache.set(token_key, time.monotonic() + INVALID_TOKEN_TTL)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Token"
         )
@@ -185,22 +261,28 @@ async def api_token_auth(token: str) -> UsersInfo:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Server Error"
         )
+    token_cache.set(token, user)
+    return user
 
 
-async def get_current_user(token: str = Security(oauth2_scheme)):
-    try:
-        return await api_token_auth(token)
-    except HTTPException as e:
-        raise e
+# the one auth dependency every route (and the TUS router) shares, so FastAPI's
+# per-request dependency cache resolves the token at most once per request
+async def get_current_user(token: str = Security(oauth2_scheme)) -> UsersInfo:
+    return await api_token_auth(token)
 
 
 ###############################
 # Routes
 
 
+# constant bodies, serialized once and shared by every response
+ROOT_BODY = orjson.dumps({"message": "Hello World"})
+HEALTH_BODY = orjson.dumps({"status": "ok"})
+
+
 @app.get("/")
 async def root():
-    return {"message": "Hello World"}
+    return Response(ROOT_BODY, media_type="application/json")
 
 
 @app.get("/auth")
@@ -212,7 +294,7 @@ async def check_token(
         if current_user
         else {"message": "Invalid Token"}
     )
-    return JSONResponse(content=user, status_code=200)
+    return ORJSONResponse(content=user, status_code=200)
 
 
 @app.get("/user/{user_id}")
@@ -232,34 +314,36 @@ async def get_user(user_id: str, function: str = ""):
                                   like changing the token. Defaults to an empty string.
 
     Returns:
-        JSONResponse: A JSON response containing the user's information.
+        ORJSONResponse: A JSON response containing the user's information.
     """
     if user_id not in ENV.ALLOWED_USERS:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail="User not allowed"
         )
-    return JSONResponse(await UserManager(user_id).get_user(function), status_code=200)
+    return ORJSONResponse(
+        await UserManager(user_id).get_user(function), status_code=200
+    )
 
 
 @app.get("/s/{file_id}")
 async def get_file(file_id: str, output: str = "file"):
-    return await FileStorage().get_file(file_id, output)
+    return await get_file_storage().get_file(file_id, output)
 
 
 @app.get("/list")
 async def list_files(current_user=Depends(get_current_user)):
-    return JSONResponse(
-        await FileStorage(current_user.user).get_files_info_list(),
+    return ORJSONResponse(
+        await get_file_storage(current_user.user).get_files_info_list(),
         status_code=200,
     )
 
 
 @app.delete("/delete/{file_id}")
 async def delete_file(file_id: str, current_user=Depends(get_current_user)):
-    if await FileStorage(current_user.user).delete_file(file_id):
+    if await get_file_storage(current_user.user).delete_file(file_id):
         logger.info(f"File {file_id} deleted")
-        return JSONResponse({"message": "File deleted"}, status_code=200)
-    return JSONResponse({"error": "File not found"}, status_code=404)
+        return ORJSONResponse({"message": "File deleted"}, status_code=200)
+    return ORJSONResponse({"error": "File not found"}, status_code=404)
 
 
 @app.delete("/delete_all/")
@@ -281,16 +365,16 @@ async def delete_all(
         current_user: Dependency injection to get the currently authenticated user.
 
     Returns:
-        JSONResponse: Confirmation of deletion success or an error message if confirmation
+        ORJSONResponse: Confirmation of deletion success or an error message if confirmation
     """
     if confirm.lower() != "yes":
-        return JSONResponse(
+        return ORJSONResponse(
             {
                 "error": "Invalid delete_all parameter. Use '?confirm=yes' to confirm deletion of all files."
             },
             status_code=404,
         )
-    return await FileStorage(current_user.user).batch_delete(function)
+    return await get_file_storage(current_user.user).batch_delete(function)
 
 
 # very basic upload
@@ -300,26 +384,41 @@ async def upload_file(
     file: UploadFile = File(...),
     current_user=Depends(get_current_user),
 ):
-    return JSONResponse(
-        await FileStorage(current_user.user).save_file(file),
+    return ORJSONResponse(
+        await get_file_storage(current_user.user).save_file(file),
         status_code=200,
     )
 
 
+# files of one batch saved at the same time
+BATCH_UPLOAD_CONCURRENCY = 8
+
+
 @app.post("/upload_batch")
 async def batch_upload_file(
     files: List[UploadFile] = [File(...)],
     current_user=Depends(get_current_user),
 ):
-    resaults = []
-    for file in files:
-        try:
-            resaults.append(await FileStorage(current_user.user).save_file(file))
-        except Exception as e:
-            logger.error(f"Error uploading file: {e}")
-            resaults.append(e)
-
-    return JSONResponse(
+    file_storage = get_file_storage(current_user.user)
+    semaphore = asyncio.Semaphore(BATCH_UPLOAD_CONCURRENCY)
+
+    async def save(file: UploadFile) -> dict:
+        async with semaphore:
+            try:
+                return await file_storage.save_file(file)
+            except Exception as e:
+                logger.error(f"Error uploading file: {e}")
+                return {
+                    "filename": file.filename,
+                    "status_code": getattr(
+                        e, "status_code", status.HTTP_500_INTERNAL_SERVER_ERROR
+                    ),
+                    "error": getattr(e, "detail", "Internal Server Error"),
+                }
+
+    resaults = await asyncio.gather(*(save(file) for file in files))
+
+    return ORJSONResponse(
         resaults,
         status_code=status.HTTP_207_MULTI_STATUS
         if any("status_code" in resault for resault in resaults)
@@ -331,18 +430,31 @@ async def batch_upload_file(
 async def websocket_upload_file(websocket: WebSocket):
     await websocket.accept()
 
-    token = await websocket.receive_text()
+    # clients that can set headers send "Authorization: Bearer <token>";
+    # browsers can't, so they send the token as the first message instead
+    scheme, _, token = websocket.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        token = await websocket.receive_text()
 
-    current_user = await api_token_auth(token)
+    try:
+        current_user = await api_token_auth(token)
+    except HTTPException as e:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=e.detail)
+        return
 
     await websocket.send_text(f"user is: {current_user.user}")
 
     try:
-        result = await FileStorage(current_user.user).save_websocket_file(websocket)
-        return JSONResponse(result, status_code=200)
+        await get_file_storage(current_user.user).save_websocket_file(websocket)
     except Exception as e:
         logger.error(f"Error during WebSocket upload: {e}")
-        return JSONResponse({"error": str(e)}, status_code=500)
+    # the upload may have ended with the client gone or with the socket
+    # already closed on our side (e.g. a failed send)
+    if (
+        websocket.client_state == WebSocketState.CONNECTED
+        and websocket.application_state == WebSocketState.CONNECTED
+    ):
+        await websocket.close()
 
 
 # TUS upload local tester with uppy
@@ -355,18 +467,20 @@ async def on_upload_complete(file_path: str, metadata: FileMetadata):
     # print(file_path)
     # print(metadata)
     try:
-        result = await FileStorage(metadata.metadata["userId"]).save_tus_file(metadata)
-        return JSONResponse(result, status_code=200)
+        result = await get_file_storage(metadata.metadata["userId"]).save_tus_file(
+            metadata
+        )
+        return ORJSONResponse(result, status_code=200)
     except Exception as e:
         logger.error(f"Error during TUS upload: {e}")
-        return JSONResponse({"error": str(e)}, status_code=500)
+        return ORJSONResponse({"error": str(e)}, status_code=500)
 
 
 # Setup TUS upload adapter
 app.include_router(
     create_api_router(
         files_dir=os.path.join(ENV.BASE_FOLDER, ENV.TUS_TEMP_FOLDER),
-        max_size=ENV.FILE_SIZE_LIMIT_MB * 1024 * 1024,
+        max_size=FILE_SIZE_LIMIT,
         on_upload_complete=on_upload_complete,
         auth=get_current_user,
         prefix="upload_tus",
@@ -376,10 +490,19 @@ app.include_router(
 
 @app.get("/health")
 async def health():
-    return JSONResponse({"status": "ok"}, status_code=200)
+    return Response(HEALTH_BODY, media_type="application/json")
 
 
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # "auto" picks uvloop/httptools when installed; WEB_CONCURRENCY sets workers
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="auto",
+        http="auto",
+        workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+        access_log=False,  # RequestLoggingMiddleware already logs each request
+    )
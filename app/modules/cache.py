@@ -1,19 +1,21 @@
 import functools
 import time
 
+from collections import OrderedDict
 from typing import Any, Dict, Optional
 
 from .env import ENV
 
 
 class Cache:
-    def __init__(self):
+    def __init__(self, ttl: int = ENV.CACHE_TTL):
+        self.ttl = ttl
         self._cache: Dict[str, Any] = {}
         self._timestamps: Dict[str, float] = {}
 
     def get(self, key: str) -> Optional[Any]:
         if key in self._cache:
-            if time.time() - self._timestamps[key] < ENV.CACHE_TTL:
+            if time.time() - self._timestamps[key] < self.ttl:
                 return self._cache[key]
             else:
                 del self._cache[key]
@@ -30,7 +32,34 @@ class Cache:
             del self._timestamps[key]
 
 
+class LRUCache:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._cache: OrderedDict[str, Any] = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        return None
+
+    def set(self, key: str, value: Any):
+        self._cache[key] = value
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+    def invalidate(self, key: str):
+        self._cache.pop(key, None)
+
+
 _cache = Cache()
+# token -> UsersInfo, so authenticated requests skip the token lookup
+token_cache = Cache(ENV.AUTH_CACHE_TTL)
+# digest of a rejected token -> expiry, so a client retrying a bad token does
+# not hit the database each time; an LRU since the keys come from clients
+INVALID_TOKEN_TTL = 60
+invalid_token_cache = LRUCache(10_000)
 
 
 def cache_result(ttl: int = ENV.CACHE_TTL):
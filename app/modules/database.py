@@ -0,0 +1,151 @@
+import asyncio
+from itertools import cycle
+from typing import Optional
+
+from loguru import logger
+from tortoise import Tortoise
+from tortoise.backends.base.client import BaseTransactionWrapper
+from tortoise.backends.base.config_generator import expand_db_url
+from tortoise.connection import connections
+
+from .env import ENV
+
+
+# Tortoise already opens sqlite in WAL mode; these trade the second fsync per
+# commit for durability-on-checkpoint and let writers wait instead of failing.
+# Anything passed as a query param in DATABASE_URL takes precedence.
+SQLITE_PRAGMAS = {
+    "synchronous": "NORMAL",
+    "temp_store": "MEMORY",
+    "cache_size": -64000,
+    "busy_timeout": 5000,
+}
+
+
+# Postgres/MySQL connection pool; sqlite has no pool and uses the
+# DATABASE_READERS connections instead
+POOL_SETTINGS = {
+    "minsize": ENV.DATABASE_POOL_MIN,
+    "maxsize": ENV.DATABASE_POOL_MAX,
+}
+# asyncpg only: keep prepared plans for the hot lookups (token, file id) and
+# recycle connections idle for five minutes
+ASYNCPG_SETTINGS = {
+    "statement_cache_size": 1024,
+    "max_inactive_connection_lifetime": 300,
+}
+
+
+def _default_connection() -> dict:
+    connection = expand_db_url(ENV.DATABASE_URL)
+    settings = {}
+    match connection["engine"]:
+        case "tortoise.backends.sqlite":
+            settings = SQLITE_PRAGMAS
+        case "tortoise.backends.asyncpg":
+            settings = {**POOL_SETTINGS, **ASYNCPG_SETTINGS}
+        case "tortoise.backends.psycopg" | "tortoise.backends.mysql":
+            settings = POOL_SETTINGS
+    for key, value in settings.items():
+        connection["credentials"].setdefault(key, value)
+    return connection
+
+
+def _reader_names(default: dict) -> list[str]:
+    # extra connections to an in-memory db would each get their own empty db
+    if (
+        default["engine"] != "tortoise.backends.sqlite"
+        or default["credentials"]["file_path"] == ":memory:"
+    ):
+        return []
+    return [f"read_{i}" for i in range(ENV.DATABASE_READERS)]
+
+
+class ReadWriteRouter:
+    """Writes go to the single "default" connection, reads are spread over the
+    reader connections, which WAL lets run alongside an in-flight write."""
+
+    def __init__(self):
+        self._readers = cycle(READERS)
+
+    def db_for_read(self, model):
+        # inside in_transaction() reads must see the transaction's own writes
+        if isinstance(connections.get("default"), BaseTransactionWrapper):
+            return None
+        return next(self._readers)
+
+    def db_for_write(self, model):
+        return "default"
+
+
+_default = _default_connection()
+READERS = _reader_names(_default)
+
+TORTOISE_ORM = {
+    "connections": {
+        "default": _default,
+        **{name: _default for name in READERS},
+    },
+    "apps": {
+        "models": {
+            "models": ["app.modules.database_models"],
+            "default_connection": "default",
+        }
+    },
+    "routers": [ReadWriteRouter] if READERS else [],
+}
+
+
+_optimize_task: Optional[asyncio.Task] = None
+
+
+async def _optimize():
+    # lets sqlite re-ANALYZE tables whose stats have drifted, cheap when not
+    await connections.get("default").execute_script("PRAGMA optimize")
+
+
+async def _optimize_loop():
+    while True:
+        await asyncio.sleep(ENV.DATABASE_OPTIMIZE_INTERVAL)
+        try:
+            await _optimize()
+        except Exception as e:
+            logger.error(f"Error optimizing database: {e}")
+
+
+async def _ensure_unique_token_index():
+    # generate_schemas never alters existing tables, so databases created
+    # before UsersInfo.token was unique get a unique index added here
+    connection = connections.get("default")
+    for index in await connection.execute_query_dict('PRAGMA index_list("usersinfo")'):
+        if not index["unique"]:
+            continue
+        columns = await connection.execute_query_dict(
+            f'PRAGMA index_info("{index["name"]}")'
+        )
+        if [column["name"] for column in columns] == ["token"]:
+            return
+    await connection.execute_script(
+        'CREATE UNIQUE INDEX IF NOT EXISTS "uid_usersinfo_token" '
+        'ON "usersinfo" ("token")'
+    )
+
+
+async def database_connect():
+    # One process-wide Tortoise setup; its connections are shared by every
+    # request and only opened/closed from the app lifespan.
+    global _optimize_task
+    await Tortoise.init(config=TORTOISE_ORM, _create_db=True)
+    await Tortoise.generate_schemas()
+    if _default["engine"] == "tortoise.backends.sqlite":
+        await _ensure_unique_token_index()
+        await _optimize()
+        _optimize_task = asyncio.create_task(_optimize_loop())
+
+
+async def database_close():
+    global _optimize_task
+    if _optimize_task:
+        _optimize_task.cancel()
+        _optimize_task = None
+    await Tortoise.close_connections()
@@ -3,7 +3,7 @@ from tortoise import fields, models
 
 class UsersInfo(models.Model):
     user = fields.CharField(max_length=255, primary_key=True)
-    token = fields.CharField(max_length=255, db_index=True)  # Added index
+    token = fields.CharField(max_length=255, unique=True)  # unique index
     total_size = fields.IntField(default=0)
     total_upload_times = fields.IntField(default=0)
     total_upload_byte = fields.IntField(default=0)
@@ -15,16 +15,12 @@ class UsersInfo(models.Model):
 
     class Meta:
         ordering = ["-created_at"]
-        indexes = [
-            "token",  # Index for faster token lookups
-        ]
 
 
 class FileInfo(models.Model):
     file_id = fields.CharField(max_length=255, primary_key=True)
-    user = fields.ForeignKeyField(
-        "models.UsersInfo", related_name="files", db_index=True
-    )
+    # no single-column index: (user_id, upload_at) below already covers it
+    user = fields.ForeignKeyField("models.UsersInfo", related_name="files")
     file_name = fields.CharField(max_length=255)
     file_type = fields.CharField(max_length=255, default="")
     file_size = fields.IntField()
@@ -1,5 +1,8 @@
 import os
-from typing import List
+from typing import FrozenSet, List
+
+
+FSYNC_MODES = ("off", "file", "batch")
 
 
 class ENV:
@@ -7,11 +10,48 @@ class ENV:
     BASE_URL: str = os.getenv("BASE_URL", "http://localhost:8000")
     BASE_FOLDER: str = os.getenv("BASE_FOLDER", f"{os.getcwd()}/uploads")
     TUS_TEMP_FOLDER: str = os.getenv("TUS_TEMP_FOLDER", "tus_upload_tmp")
-    ALLOWED_USERS: List[str] = os.getenv("ALLOWED_USERS", "testuser").split(",")
+    # a set for O(1) lookups; empty entries dropped so "" really means no users
+    ALLOWED_USERS: FrozenSet[str] = frozenset(
+        filter(None, os.getenv("ALLOWED_USERS", "testuser").split(","))
+    )
     ALLOWED_ORIGINS: List[str] = os.getenv("ALLOWED_ORIGINS", "*").split(",")
     DEFAULT_SHORT_PATH_LENGTH: int = int(os.getenv("DEFAULT_SHORT_PATH_LENGTH", 8))
     FILE_SIZE_LIMIT_MB: int = int(os.getenv("FILE_SIZE_LIMIT_MB", 10))
     TOTAL_SIZE_LIMIT_MB: int = int(os.getenv("TOTAL_SIZE_LIMIT_MB", 500))
+    # no single request can carry more than a user may store in total
+    REQUEST_SIZE_LIMIT_MB: int = int(
+        os.getenv("REQUEST_SIZE_LIMIT_MB", TOTAL_SIZE_LIMIT_MB)
+    )
     DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite://./uploads/blobserver.db")
+    # sqlite connections used for reads next to the single writer
+    DATABASE_READERS: int = int(os.getenv("DATABASE_READERS", 4))
+    # connection pool bounds for postgres/mysql
+    DATABASE_POOL_MIN: int = int(os.getenv("DATABASE_POOL_MIN", 5))
+    DATABASE_POOL_MAX: int = int(os.getenv("DATABASE_POOL_MAX", 20))
+    # seconds between background "PRAGMA optimize" runs
+    DATABASE_OPTIMIZE_INTERVAL: int = int(os.getenv("DATABASE_OPTIMIZE_INTERVAL", 900))
     CACHE_TTL: int = int(os.getenv("CACHE_TTL", 300))  # 5 minutes cache
+    # also how long an old token keeps working in other worker processes
+    AUTH_CACHE_TTL: int = int(os.getenv("AUTH_CACHE_TTL", 60))
+    # "off" leaves flushing to the OS, "file" fsyncs every upload before
+    # replying, "batch" group-commits fsyncs in the background
+    FSYNC_UPLOADS: str = os.getenv("FSYNC_UPLOADS", "off").strip().lower()
+    FSYNC_BATCH_INTERVAL_MS: int = int(os.getenv("FSYNC_BATCH_INTERVAL_MS", 50))
+    # when served behind nginx, an internal location aliased to BASE_FOLDER
+    # (e.g. "/_protected"); downloads are then handed off via X-Accel-Redirect
+    X_ACCEL_REDIRECT_PREFIX: str = os.getenv("X_ACCEL_REDIRECT_PREFIX", "").rstrip("/")
+    # log records are buffered and written out at this interval; 0 writes
+    # every record straight to stderr
+    LOG_FLUSH_INTERVAL_MS: int = int(os.getenv("LOG_FLUSH_INTERVAL_MS", 1000))
+    FILE_INFO_CACHE_SIZE: int = int(os.getenv("FILE_INFO_CACHE_SIZE", 10000))
     REQUEST_TIMES_PER_MINTUE: int = int(os.getenv("REQUEST_TIMES_PER_MINTUE", 100))
+    # e.g. redis://localhost:6379/0 to share rate limits between workers
+    REDIS_URL: str = os.getenv("REDIS_URL", "")
+
+
+# a misspelt mode would otherwise silently mean "off"
+if ENV.FSYNC_UPLOADS not in FSYNC_MODES:
+    raise ValueError(
+        f"FSYNC_UPLOADS must be one of {', '.join(FSYNC_MODES)}, "
+        f"got {ENV.FSYNC_UPLOADS!r}"
+    )
@@ -1,9 +1,16 @@
 import asyncio
+import contextlib
+import html
+import io
 import os
 import shutil
+import sqlite3
+import threading
+from datetime import timedelta
+from functools import lru_cache
+from urllib.parse import quote
 
-# import aiofiles
-import pendulum
+import aiofiles.os
 
 # from urllib.parse import unquote
 from fastapi import (
@@ -14,27 +21,243 @@ from fastapi import (
     WebSocketDisconnect,
     status,
 )
-from fastapi.responses import FileResponse, HTMLResponse, JSONResponse
-from typing import List, Literal, Optional
+from fastapi.responses import FileResponse, HTMLResponse, ORJSONResponse, Response
+from typing import Any, BinaryIO, List, Literal, Optional, Set, Tuple
 from loguru import logger
 
-from tortoise import timezone as tz
+from tortoise import connections, timezone as tz
+from tortoise.expressions import F
+from tortoise.functions import Sum
+from tortoise.queryset import UpdateQuery
 from tortoise.transactions import in_transaction
 from tortoise.exceptions import DoesNotExist
 
 from app.modules.tusserver.metadata import FileMetadata
 
-from .cache import cache_result
+from .cache import LRUCache
 from .utils import json_datetime_convert, generate_random_string
 from .database_models import UsersInfo, FileInfo
 from .env import ENV
 
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+FILE_SIZE_LIMIT = ENV.FILE_SIZE_LIMIT_MB * 1024 * 1024
+TOTAL_SIZE_LIMIT = ENV.TOTAL_SIZE_LIMIT_MB * 1024 * 1024
+BATCH_DELETE_CONCURRENCY = 16
+# databases that take UPDATE ... RETURNING: postgres, and sqlite only from
+# 3.35 on (the library Python is linked against); mysql not at all
+RETURNING_DIALECTS = frozenset(
+    ["postgres"] + (["sqlite"] if sqlite3.sqlite_version_info >= (3, 35) else [])
+)
+# websocket files received ahead of the writer, and written per thread hop
+WEBSOCKET_QUEUE_SIZE = 16
+WEBSOCKET_WRITE_BATCH = 8
+
+# pre-encoded so a response is one bytes % (escaped name, file id)
+IMAGE_HTML_TEMPLATE = b"""
+    <!DOCTYPE html>
+    <html>
+    <head><title>Image</title></head>
+    <body><h1>Image %b</h1>
+    <img src="/s/%b" alt="Uploaded Image" style="max-width:100%%">
+    </body>
+    </html>
+"""
+
+# columns returned by /list and /s/{file_id}?output=json
+FILE_INFO_FIELDS = (
+    "file_id",
+    "user_id",
+    "file_name",
+    "file_type",
+    "file_size",
+    "upload_at",
+    "download_times",
+    "last_download_at",
+)
+
+# file_id -> (file_name, file_size, owner), these never change after upload
+_file_info_cache = LRUCache(ENV.FILE_INFO_CACHE_SIZE)
+
+# user folders already created by this process
+_ensured_folders: Set[str] = set()
+
+_fdatasync = getattr(os, "fdatasync", os.fsync)
+_fsync_queue: Optional[asyncio.Queue] = None
+_fsync_task: Optional[asyncio.Task] = None
+
+
+def _fsync_dir(path: str):
+    # the rename or move that put an upload in place is only durable once
+    # the directory holding it is synced too
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_paths(paths: List[str]):
+    for path in paths:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            continue  # deleted before it was flushed
+        try:
+            _fdatasync(fd)
+        finally:
+            os.close(fd)
+    # each folder once per batch, however many of its files were synced
+    for folder in {os.path.dirname(path) for path in paths}:
+        _fsync_dir(folder)
+
+
+async def _group_fsync_worker(queue: asyncio.Queue):
+    # group commit: wait a short window after the first path arrives, then
+    # flush everything queued so far in one worker thread call
+    while True:
+        paths = [await queue.get()]
+        try:
+            await asyncio.sleep(ENV.FSYNC_BATCH_INTERVAL_MS / 1000)
+        finally:
+            # also reached when cancelled at shutdown, so the paths already
+            # taken off the queue are still synced
+            while not queue.empty():
+                paths.append(queue.get_nowait())
+            try:
+                await asyncio.to_thread(_fsync_paths, paths)
+            except OSError as e:
+                logger.error(f"Error syncing uploaded files: {e}")
+
+
+def _returning(update: UpdateQuery, column: str) -> Tuple[str, List[Any]]:
+    # UpdateQuery.sql() inlines the filter values and leaves placeholders only
+    # for the SET values, collected in .values; tests/test_file_storage.py
+    # checks this still holds so an upgrade can't silently misbind them
+    return f'{update.sql()} RETURNING "{column}"', update.values
+
+
+async def _remove_file(file_path: str):
+    # one unlink instead of exists() + remove(), and no race with a
+    # concurrent delete of the same file
+    try:
+        await aiofiles.os.remove(file_path)
+    except FileNotFoundError:
+        pass
+
+
+def _kernel_copy(source: BinaryIO, dest: BinaryIO, size_limit: int) -> Optional[int]:
+    # uploads that were spooled to disk are copied file-to-file with
+    # sendfile(2), skipping the read()/write() round trip through Python;
+    # returns None when the caller has to copy in chunks instead
+    # `_rolled` is a private attribute of CPython's SpooledTemporaryFile,
+    # read instead of calling fileno() since that forces an in-memory upload
+    # to disk; on interpreters without it everything is copied in chunks
+    if not getattr(source, "_rolled", False) or not hasattr(os, "sendfile"):
+        return None
+    try:
+        in_fd = source.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        return None
+    offset = source.tell()
+    size = os.fstat(in_fd).st_size - offset
+    if size > size_limit:
+        return size
+    sent = 0
+    while sent < size:
+        try:
+            count = os.sendfile(dest.fileno(), in_fd, offset + sent, size - sent)
+        except OSError:
+            if sent:
+                raise
+            return None  # not supported for these files here
+        if not count:
+            break
+        sent += count
+    return sent
+
+
+def _schedule_fsync(file_path: str):
+    global _fsync_queue, _fsync_task
+    if _fsync_queue is None:
+        _fsync_queue = asyncio.Queue()
+        _fsync_task = asyncio.create_task(_group_fsync_worker(_fsync_queue))
+    _fsync_queue.put_nowait(file_path)
+
+
+async def fsync_close():
+    """Sync the uploads still queued for the group fsync and stop its worker,
+    so nothing acknowledged is left unsynced at shutdown."""
+    global _fsync_queue, _fsync_task
+    if _fsync_task is None:
+        return
+    _fsync_task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await _fsync_task
+    paths = []
+    while not _fsync_queue.empty():
+        paths.append(_fsync_queue.get_nowait())
+    if paths:
+        await asyncio.to_thread(_fsync_paths, paths)
+    _fsync_queue, _fsync_task = None, None
+
+
+class _BlobWriter:
+    """Writes websocket uploads from a worker thread, each through a temp file
+    and rename like _copy_upload so FSYNC_UPLOADS applies. Files discarded
+    while the thread is still writing are removed by the thread when it is
+    done, so cleanup does not depend on the request task (or its event loop)
+    surviving a cancellation."""
+
+    def __init__(self, file_paths: List[str], blobs: List[bytes], fsync: bool):
+        self.file_paths = file_paths
+        self.blobs = blobs
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._finished = False
+        self._discarded: List[str] = []
+
+    @staticmethod
+    def _remove(file_paths: List[str]):
+        for file_path in file_paths:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(file_path)
+
+    def write(self):
+        try:
+            for file_path, data in zip(self.file_paths, self.blobs):
+                FileStorage._copy_upload(
+                    io.BytesIO(data), file_path, len(data), self.fsync
+                )
+        finally:
+            with self._lock:
+                self._finished = True
+                self._remove(self._discarded)
+
+    def discard(self, file_paths: List[str]):
+        with self._lock:
+            if self._finished:
+                self._remove(file_paths)
+            else:
+                self._discarded = file_paths
+
 
 class FileStorage:
     def __init__(self, user: str = ""):
         self.folder = os.path.join(ENV.BASE_FOLDER, user)
-        os.makedirs(self.folder, exist_ok=True)
         self.user = user
+        self._user_info: Optional[UsersInfo] = None
+
+    async def _get_user_info(self) -> UsersInfo:
+        # loaded once per FileStorage; _update_user_usage keeps its total_size
+        # current, the other counters are only read fresh by UserManager
+        if self._user_info is None:
+            self._user_info = await UsersInfo.get(user=self.user)
+        return self._user_info
+
+    async def _ensure_folder(self):
+        if self.folder not in _ensured_folders:
+            await aiofiles.os.makedirs(self.folder, exist_ok=True)
+            _ensured_folders.add(self.folder)
 
     async def _validate_file_size(self, file: UploadFile):
         if not hasattr(file, "size"):
@@ -42,14 +265,17 @@ class FileStorage:
             file.size = file.file.tell()
             file.file.seek(0)
 
-        if file.size and file.size > ENV.FILE_SIZE_LIMIT_MB * 1024 * 1024:
+        if file.size and file.size > FILE_SIZE_LIMIT:
             raise HTTPException(
                 status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
                 detail=f"File size exceeds limit of [{ENV.FILE_SIZE_LIMIT_MB}] MB",
             )
 
-        user = await UsersInfo.get(user=self.user)
-        if user.total_size + (file.size or 0) > ENV.TOTAL_SIZE_LIMIT_MB * 1024 * 1024:
+        user = await self._get_user_info()
+        if user.total_size + (file.size or 0) > TOTAL_SIZE_LIMIT:
+            # the cached row can lag behind other processes, confirm first
+            await user.refresh_from_db(fields=["total_size"])
+        if user.total_size + (file.size or 0) > TOTAL_SIZE_LIMIT:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail=f"Total size limit of [{ENV.TOTAL_SIZE_LIMIT_MB}] MB exceeded",
@@ -61,77 +287,166 @@ class FileStorage:
         function: Literal["upload", "delete", "download"] = "upload",
     ):
         try:
-            async with in_transaction():
-                user = await UsersInfo.get(user=self.user)
+            async with in_transaction("default"):
+                user = await self._get_user_info()
+                query = UsersInfo.filter(user=self.user)
                 match function:
                     case "upload":
-                        user.total_upload_byte += file_size
-                        user.total_upload_times += 1
-                        user.last_upload_at = tz.now()
+                        # the quota check rides on the UPDATE itself so two
+                        # concurrent uploads can't both pass it
+                        query = query.filter(
+                            total_size__lte=TOTAL_SIZE_LIMIT - file_size
+                        )
+                        updates = {
+                            "total_size": F("total_size") + file_size,
+                            "total_upload_byte": F("total_upload_byte") + file_size,
+                            "total_upload_times": F("total_upload_times") + 1,
+                            "last_upload_at": tz.now(),
+                        }
                     case "delete":
-                        pass
+                        updates = {"total_size": F("total_size") - file_size}
                     case "download":
-                        user.total_download_byte += file_size
-                        user.total_download_times += 1
-                        user.last_download_at = tz.now()
+                        updates = {
+                            "total_download_byte": F("total_download_byte") + file_size,
+                            "total_download_times": F("total_download_times") + 1,
+                            "last_download_at": tz.now(),
+                        }
                     case _:
                         raise ValueError("Invalid function")
 
-                user.total_size = await self._get_total_size()
                 logger.info(
                     f"Update {user.user} usage: {function} {file_size/(1024*1024):.3f} MB"
                 )
-                await user.save()
-                return {
-                    "available_space": f"{(
-                        ENV.TOTAL_SIZE_LIMIT_MB * 1024 * 1024 - user.total_size
+                # counters are applied as deltas in SQL and, where supported,
+                # the new total comes back from the same statement
+                update = query.update(**updates)
+                connection = connections.get("default")
+                if connection.capabilities.dialect in RETURNING_DIALECTS:
+                    rows = await connection.execute_query_dict(
+                        *_returning(update, "total_size")
                     )
-                    / (1024 * 1024):.3f} MB"
-                }
+                    updated = bool(rows)
+                    if updated:
+                        user.total_size = rows[0]["total_size"]
+                else:
+                    updated = bool(await update)
+                    if updated:
+                        await user.refresh_from_db(fields=["total_size"])
+                if not updated:
+                    raise HTTPException(
+                        status_code=status.HTTP_403_FORBIDDEN,
+                        detail=f"Total size limit of [{ENV.TOTAL_SIZE_LIMIT_MB}] MB exceeded",
+                    )
+                available_space = (TOTAL_SIZE_LIMIT - user.total_size) / (1024 * 1024)
+                return {"available_space": f"{available_space:.3f} MB"}
         except DoesNotExist:
             raise HTTPException(status_code=404, detail="User not found")
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"Error updating user usage: {e}")
             raise HTTPException(status_code=500, detail="Internal Server Error")
 
     async def _get_total_size(self) -> int:
+        # summed by the database, one row back instead of every file
+        total = (
+            await FileInfo.filter(user_id=self.user)
+            .annotate(total=Sum("file_size"))
+            .first()
+            .values_list("total", flat=True)
+        )
+        return total or 0
+
+    async def _stat_file(self, file_path: str) -> Optional[os.stat_result]:
         try:
-            files = await FileInfo.filter(user=self.user).all()
-            return sum(file.file_size for file in files)
-        except Exception as e:
-            logger.error(f"Error getting total size: {e}")
-            return 0
-
-    def _check_file_path(self, file_id: str) -> Optional[str]:
-        file_path = self._get_file_path(file_id)
-        return file_path if os.path.exists(file_path) else None
+            return await aiofiles.os.stat(file_path)
+        except FileNotFoundError:
+            return None
 
     def _get_file_path(self, file_id: str) -> str:
         return os.path.join(self.folder, file_id)
 
-    async def _load_file_info(self, file_id: str) -> Optional[FileInfo]:
+    @staticmethod
+    def _copy_upload(
+        source: BinaryIO, file_path: str, size_limit: int, fsync: bool = False
+    ) -> int:
+        # written next to the target and renamed into place only when
+        # complete, so a crash or rejection never leaves a partial file behind
+        temp_path = f"{file_path}.{os.getpid()}.tmp"
+        written = 0
         try:
-            return await FileInfo.get(file_id=file_id)
-        except DoesNotExist:
-            return None
-        except Exception as e:
-            logger.error(f"Error loading file info: {e}")
-            return None
-
-    def _write_file(self, file: UploadFile, file_path: str):
+            with open(temp_path, "wb") as f:
+                copied = _kernel_copy(source, f, size_limit)
+                if copied is not None:
+                    written = copied
+                else:
+                    while chunk := source.read(UPLOAD_CHUNK_SIZE):
+                        written += len(chunk)
+                        if written > size_limit:
+                            break
+                        f.write(chunk)
+                if fsync and written <= size_limit:
+                    f.flush()
+                    _fdatasync(f.fileno())
+            if written > size_limit:
+                os.remove(temp_path)
+            else:
+                os.replace(temp_path, file_path)
+                if fsync:
+                    _fsync_dir(os.path.dirname(file_path))
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(temp_path)
+            raise
+        return written
+
+    async def _write_file(self, file: UploadFile, file_path: str) -> int:
+        # stream in chunks so memory stays bounded and oversized bodies are
+        # rejected as soon as they cross the limit; the whole copy runs in one
+        # worker thread instead of hopping threads for every chunk
         try:
-            with open(file_path, "wb") as f:
-                f.write(file.file.read())
+            written = await asyncio.to_thread(
+                self._copy_upload,
+                file.file,
+                file_path,
+                FILE_SIZE_LIMIT,
+                ENV.FSYNC_UPLOADS == "file",
+            )
         except IOError as e:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Failed to write file: {e}",
             )
 
-    def _move_file(self, temp_path: str, file_path: str):
+        if written > FILE_SIZE_LIMIT:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"File size exceeds limit of [{ENV.FILE_SIZE_LIMIT_MB}] MB",
+            )
+        if ENV.FSYNC_UPLOADS == "batch":
+            _schedule_fsync(file_path)
+        return written
+
+    async def _discard_file(self, file_path: str):
+        # a usage update may have been rolled back with the upload, so the
+        # cached user row is reloaded on next use
+        self._user_info = None
+        await _remove_file(file_path)
+
+    @staticmethod
+    def _move_upload(temp_path: str, file_path: str, fsync: bool = False):
+        shutil.move(temp_path, file_path)
+        if fsync:
+            _fsync_paths([file_path])
+
+    async def _move_file(self, temp_path: str, file_path: str):
         try:
-            print(f"{temp_path=}---{file_path=}")
-            shutil.move(temp_path, file_path)
+            await asyncio.to_thread(
+                self._move_upload,
+                temp_path,
+                file_path,
+                ENV.FSYNC_UPLOADS == "file",
+            )
             # os.remove(f"{temp_path}.info")
         except IOError as e:
             raise HTTPException(
@@ -143,7 +458,7 @@ class FileStorage:
         try:
             await FileInfo.create(
                 file_id=file_id,
-                user=await UsersInfo.get(user=self.user),
+                user=await self._get_user_info(),
                 file_name=file.filename,
                 file_size=file.size,
             )
@@ -155,7 +470,7 @@ class FileStorage:
         try:
             await FileInfo.create(
                 file_id=file_id,
-                user=await UsersInfo.get(user=self.user),
+                user=await self._get_user_info(),
                 file_name=filename,
                 file_size=file_size,
             )
@@ -170,7 +485,7 @@ class FileStorage:
             await FileInfo.update_or_create(
                 file_id=file_id,
                 defaults={
-                    "user": await UsersInfo.get(user=self.user),
+                    "user": await self._get_user_info(),
                     "file_name": file_name,
                     "file_type": file_type,
                     "file_size": file_size,
@@ -180,17 +495,11 @@ class FileStorage:
             logger.error(f"Error saving file info chunk: {e}")
             raise HTTPException(status_code=500, detail="Internal Server Error")
 
-    @cache_result(ttl=60)  # Cache for 1 minute
     async def get_files_info_list(self) -> List[dict]:
         try:
-            files = (
-                await FileInfo.filter(user=await UsersInfo.get(user=self.user))
-                .prefetch_related("user")
-                .all()
-            )
+            # plain dicts straight from the driver, no model instances
+            files = await FileInfo.filter(user_id=self.user).values(*FILE_INFO_FIELDS)
             return [json_datetime_convert(f) for f in files]
-        except DoesNotExist:
-            return []
         except Exception as e:
             logger.error(f"Error loading file info: {e}")
             raise HTTPException(status_code=500, detail="Internal Server Error")
@@ -200,9 +509,16 @@ class FileStorage:
             await self._validate_file_size(file)
             file_id = generate_random_string(ENV.DEFAULT_SHORT_PATH_LENGTH)
             file_path = self._get_file_path(file_id)
-            self._write_file(file, file_path)
-            await self._save_file_info(file_id, file)
-            available_space = await self._update_user_usage(file.size or 0)
+            await self._ensure_folder()
+            file.size = await self._write_file(file, file_path)
+            try:
+                # quota reservation and file row commit together, one fsync
+                async with in_transaction("default"):
+                    available_space = await self._update_user_usage(file.size or 0)
+                    await self._save_file_info(file_id, file)
+            except HTTPException:
+                await self._discard_file(file_path)
+                raise
             return {
                 "file_id": file_id,
                 "file_url": f"{ENV.BASE_URL}/s/{file_id}",
@@ -223,16 +539,24 @@ class FileStorage:
         try:
             file_id = generate_random_string(ENV.DEFAULT_SHORT_PATH_LENGTH)
             file_path = self._get_file_path(file_id)
-            self._move_file(
+            await self._ensure_folder()
+            await self._move_file(
                 f"{ENV.BASE_FOLDER}/{ENV.TUS_TEMP_FOLDER}/{metadata.uid}", file_path
             )
-            await self._save_file_info_tus(
-                file_id,
-                file_name=metadata.metadata["filename"],
-                file_type=metadata.metadata["filetype"],
-                file_size=metadata.size,
-            )
-            available_space = await self._update_user_usage(metadata.size or 0)
+            try:
+                async with in_transaction("default"):
+                    available_space = await self._update_user_usage(metadata.size or 0)
+                    await self._save_file_info_tus(
+                        file_id,
+                        file_name=metadata.metadata["filename"],
+                        file_type=metadata.metadata["filetype"],
+                        file_size=metadata.size,
+                    )
+            except HTTPException:
+                await self._discard_file(file_path)
+                raise
+            if ENV.FSYNC_UPLOADS == "batch":
+                _schedule_fsync(file_path)
             return {
                 "file_id": file_id,
                 "file_url": f"{ENV.BASE_URL}/s/{file_id}",
@@ -249,95 +573,198 @@ class FileStorage:
             logger.error(f"Error uploading file: {e}")
             raise HTTPException(status_code=500, detail="Internal Server Error")
 
-    async def save_websocket_file(self, websocket: WebSocket) -> None:
+    async def _save_socket_files(
+        self, websocket: WebSocket, files: List[Tuple[str, bytes]]
+    ):
+        file_ids = [
+            generate_random_string(ENV.DEFAULT_SHORT_PATH_LENGTH) for _ in files
+        ]
+        file_paths = [self._get_file_path(file_id) for file_id in file_ids]
+        blobs = _BlobWriter(
+            file_paths, [data for _, data in files], ENV.FSYNC_UPLOADS == "file"
+        )
+        write = asyncio.ensure_future(asyncio.to_thread(blobs.write))
+        committed = 0
+        committing = False
+        try:
+            # shielded, a cancelled request leaves the thread to finish and
+            # clean up after itself (see _BlobWriter)
+            await asyncio.shield(write)
+            for file_id, file_path, (file_name, data) in zip(
+                file_ids, file_paths, files
+            ):
+                committing = True
+                async with in_transaction("default"):
+                    await self._update_user_usage(len(data))
+                    await self._save_file_info_socket(file_id, file_name, len(data))
+                committing = False
+                committed += 1
+                if ENV.FSYNC_UPLOADS == "batch":
+                    _schedule_fsync(file_path)
+                await websocket.send_json(
+                    {
+                        "file_id": file_id,
+                        "file_url": f"{ENV.BASE_URL}/s/{file_id}",
+                        "show_image": f"{ENV.BASE_URL}/s/{file_id}?output=html",
+                    }
+                )
+        except asyncio.CancelledError:
+            # cancelled inside the commit, the row may already exist; keep
+            # that file rather than leave a row pointing at nothing
+            committed += committing
+            raise
+        finally:
+            # whatever was not committed (quota rejection, disconnect,
+            # cancellation) has no row and no quota charge, so it must not
+            # stay on disk
+            if committed < len(file_paths):
+                self._user_info = None
+                blobs.discard(file_paths[committed:])
+
+    @staticmethod
+    async def _receive_socket_files(websocket: WebSocket, queue: asyncio.Queue):
         try:
             while True:
                 file_name = await websocket.receive_text()  # Receive the file name
-                file_id = generate_random_string(ENV.DEFAULT_SHORT_PATH_LENGTH)
-                file_path = self._get_file_path(file_id)
-                with open(file_path, "wb") as file:
-                    try:
-                        data = await websocket.receive_bytes()  # Receive the file data
-                        if not data:
-                            break
-                        file.write(data)  # Write the data into the file
-                        file_size = len(data)
-                        await self._save_file_info_socket(file_id, file_name, file_size)
-                        await websocket.send_json(
-                            {
-                                "file_id": file_id,
-                                "file_url": f"{ENV.BASE_URL}/s/{file_id}",
-                                "show_image": f"{ENV.BASE_URL}/s/{file_id}?output=html",
-                            }
-                        )
-                        await self._update_user_usage(file_size, function="upload")
-                    except WebSocketDisconnect:
-                        break  # Client disconnected
+                data = await websocket.receive_bytes()  # Receive the file data
+                if not data:
+                    break
+                await queue.put((file_name, data))
+        except WebSocketDisconnect:
+            pass  # Client disconnected
+
+    async def _write_socket_files(
+        self, websocket: WebSocket, queue: asyncio.Queue, receiver: asyncio.Task
+    ):
+        failed = False
+        while True:
+            batch = [await queue.get()]
+            while (
+                batch[-1] is not None
+                and len(batch) < WEBSOCKET_WRITE_BATCH
+                and not queue.empty()
+            ):
+                batch.append(queue.get_nowait())
+            files = [item for item in batch if item is not None]
+            if files and not failed:
+                try:
+                    await self._save_socket_files(websocket, files)
+                except Exception as e:
+                    logger.error(f"Error saving file: {e}")
+                    # stop reading; whatever is still queued is dropped
+                    failed = True
+                    receiver.cancel()
+            if batch[-1] is None:
+                return
 
+    async def save_websocket_file(self, websocket: WebSocket) -> None:
+        # the next file is received while earlier ones are written and
+        # committed; the bounded queue holds the client back when disk lags
+        queue: asyncio.Queue = asyncio.Queue(maxsize=WEBSOCKET_QUEUE_SIZE)
+        try:
+            await self._ensure_folder()
         except Exception as e:
             logger.error(f"Error saving file: {e}")
+            return
+        receiver = asyncio.create_task(self._receive_socket_files(websocket, queue))
+        writer = asyncio.create_task(
+            self._write_socket_files(websocket, queue, receiver)
+        )
+        try:
+            (received,) = await asyncio.gather(receiver, return_exceptions=True)
+            if isinstance(received, Exception):
+                logger.error(f"Error saving file: {received}")
+            # the writer keeps consuming until it sees the end marker
+            await queue.put(None)
+            await writer
+        finally:
+            receiver.cancel()
+            writer.cancel()
 
     async def get_file(
         self, file_id: str, output: str = "file"
-    ) -> HTMLResponse | JSONResponse | FileResponse:
-        try:
-            file_info = await FileInfo.get(file_id=file_id)
-            await file_info.fetch_related("user")
-            current_user = file_info.user.user
-        except DoesNotExist:
-            raise HTTPException(status_code=404, detail="File not found")
-
-        file_storage = FileStorage(current_user)
-        try:
-            file_path = file_storage._check_file_path(file_id)
-            if not file_path:
+    ) -> HTMLResponse | ORJSONResponse | FileResponse | Response:
+        cached_info = _file_info_cache.get(file_id)
+        if cached_info is None:
+            try:
+                # a bare tuple; the owner is the user_id column, no join needed
+                cached_info = (
+                    await FileInfo.filter(file_id=file_id)
+                    .first()
+                    .values_list("file_name", "file_size", "user_id")
+                )
+            except Exception as e:
+                logger.error(f"Error getting file: {e}")
+                raise HTTPException(status_code=500, detail="Internal Server Error")
+            if cached_info is None:
                 raise HTTPException(status_code=404, detail="File not found")
-
-            file_info = await file_storage._load_file_info(file_id)
-            if not file_info:
-                raise HTTPException(status_code=404, detail="File info not found")
-        except Exception as e:
-            logger.error(f"Error getting file: {e}")
-            raise HTTPException(status_code=500, detail="Internal Server Error")
+            _file_info_cache.set(file_id, cached_info)
+        file_name, file_size, owner = cached_info
+
+        file_storage = get_file_storage(owner)
+        file_path = file_storage._get_file_path(file_id)
+        # stat once here and hand it to FileResponse so it doesn't stat again
+        stat_result = await file_storage._stat_file(file_path)
+        if not stat_result:
+            raise HTTPException(status_code=404, detail="File not found")
 
         match output:
             case "html":
-                html_content = f"""
-                    <!DOCTYPE html>
-                    <html>
-                    <head><title>Image</title></head>
-                    <body><h1>Image {file_info.file_name}</h1>
-                    <img src="/s/{file_id}" alt="Uploaded Image" style="max-width:100%">
-                    </body>
-                    </html>
-                """
+                html_content = IMAGE_HTML_TEMPLATE % (
+                    html.escape(file_name).encode(),
+                    file_id.encode(),
+                )
                 return HTMLResponse(content=html_content, status_code=200)
             case "json":
-                return JSONResponse(json_datetime_convert(file_info), status_code=200)
-            case _:
-                await file_storage._update_user_usage(
-                    file_info.file_size, function="download"
+                # download counters change, so the row is always read fresh
+                file_info = (
+                    await FileInfo.filter(file_id=file_id)
+                    .first()
+                    .values(*FILE_INFO_FIELDS)
                 )
-                file_info.download_times += 1
-                file_info.last_download_at = tz.now()
-                await file_info.save()
-                disposition = "inline" if output != "download" else "attachment"
-                return FileResponse(
+                if file_info is None:
+                    raise HTTPException(status_code=404, detail="File not found")
+                return ORJSONResponse(json_datetime_convert(file_info), status_code=200)
+            case _:
+                # owner and file counters share one commit
+                async with in_transaction("default"):
+                    await file_storage._update_user_usage(file_size, "download")
+                    await FileInfo.filter(file_id=file_id).update(
+                        download_times=F("download_times") + 1,
+                        last_download_at=tz.now(),
+                    )
+                # let starlette build (and RFC 5987 encode) Content-Disposition
+                response = FileResponse(
                     file_path,
-                    filename=file_info.file_name,
-                    headers={
-                        "Content-Disposition": f'{disposition}; filename="{file_info.file_name.encode("utf-8").decode("latin-1")}"'
-                    },
+                    stat_result=stat_result,
+                    filename=file_name,
+                    content_disposition_type=(
+                        "attachment" if output == "download" else "inline"
+                    ),
                 )
+                if ENV.X_ACCEL_REDIRECT_PREFIX:
+                    # nginx sends the body itself with sendfile(2)
+                    return Response(
+                        media_type=response.media_type,
+                        headers={
+                            "Content-Disposition": response.headers[
+                                "content-disposition"
+                            ],
+                            "X-Accel-Redirect": f"{ENV.X_ACCEL_REDIRECT_PREFIX}/"
+                            f"{quote(owner)}/{quote(file_id)}",
+                        },
+                    )
+                return response
 
     async def delete_file(self, file_id: str, skip_usage_update: bool = False) -> bool:
         try:
-            file = await FileInfo.get(file_id=file_id, user=self.user)
+            file = await FileInfo.get(file_id=file_id, user_id=self.user).only(
+                "file_id", "file_size"
+            )
             file_size = file.file_size
-            file_path = self._get_file_path(file_id)
-            if os.path.exists(file_path):
-                os.remove(file_path)
+            await _remove_file(self._get_file_path(file_id))
             await file.delete()
+            _file_info_cache.invalidate(file_id)
             if not skip_usage_update:
                 await self._update_user_usage(file_size, function="delete")
             return True
@@ -347,58 +774,79 @@ class FileStorage:
             logger.error(f"Error deleting file: {e}")
             raise HTTPException(status_code=500, detail="Internal Server Error")
 
-    async def batch_delete(self, function="all") -> JSONResponse:
+    async def _remove_files(self, file_ids: List[str]):
+        # unlink concurrently with bounded fan-out
+        semaphore = asyncio.Semaphore(BATCH_DELETE_CONCURRENCY)
+
+        async def remove(file_id: str):
+            async with semaphore:
+                await _remove_file(self._get_file_path(file_id))
+
+        await asyncio.gather(*[remove(file_id) for file_id in file_ids])
+
+    async def _delete_files(self, file_ids: List[str]):
+        # drop all rows and update usage in one query each instead of per
+        # file; the files themselves go in _remove_deleted_files once this
+        # has committed, so a rolled back delete never loses them
+        await FileInfo.filter(file_id__in=file_ids).delete()
+        # bulk deletes also resync the running total from what is left,
+        # correcting any drift in the incremental counter
+        await UsersInfo.filter(user=self.user).update(
+            total_size=await self._get_total_size()
+        )
+
+    async def _remove_deleted_files(self, file_ids: List[str]):
+        for file_id in file_ids:
+            _file_info_cache.invalidate(file_id)
+        if self._user_info is not None:
+            await self._user_info.refresh_from_db(fields=["total_size"])
+        await self._remove_files(file_ids)
+
+    async def batch_delete(self, function="all") -> ORJSONResponse:
         try:
-            async with in_transaction():
-                if function == "all":
-                    files = await FileInfo.filter(user=self.user).all()
-                    logger.info(f"Deleting {len(files)} files for user {self.user}...")
-
-                    # Use asyncio.gather for parallel deletion but skip usage updates
-                    await asyncio.gather(
-                        *[
-                            self.delete_file(file.file_id, skip_usage_update=True)
-                            for file in files
-                        ]
+            if function == "all":
+                async with in_transaction("default"):
+                    # only these rows are deleted: an upload committed
+                    # meanwhile keeps its row, its file and its usage, and
+                    # in-flight temp files are left alone
+                    file_ids = await FileInfo.filter(user_id=self.user).values_list(
+                        "file_id", flat=True
                     )
-
-                    # Update usage once after all files are deleted
-                    await self._update_user_usage(0, function="delete")
-
-                    return JSONResponse(
-                        {"message": "All files deleted"}, status_code=200
-                    )
-
-                elif function == "expired":
-                    cutoff = pendulum.now().subtract(days=90)
-                    files = await FileInfo.filter(
-                        user=self.user, upload_at__lt=cutoff
-                    ).all()
                     logger.info(
-                        f"Deleting {len(files)} expired files for user {self.user}..."
+                        f"Deleting {len(file_ids)} files for user {self.user}..."
                     )
+                    await self._delete_files(file_ids)
+                await self._remove_deleted_files(file_ids)
 
-                    # Use asyncio.gather for parallel deletion but skip usage updates
-                    await asyncio.gather(
-                        *[
-                            self.delete_file(file.file_id, skip_usage_update=True)
-                            for file in files
-                        ]
-                    )
-
-                    # Update usage once after all files are deleted
-                    await self._update_user_usage(0, function="delete")
+                return ORJSONResponse({"message": "All files deleted"}, status_code=200)
 
-                    return JSONResponse(
-                        {
-                            "message": "All files not been download for 90 days are deleted"
-                        },
-                        status_code=200,
-                    )
-                else:
-                    return JSONResponse(
-                        {"error": "Invalid function parameter"}, status_code=405
+            elif function == "expired":
+                async with in_transaction("default"):
+                    cutoff = tz.now() - timedelta(days=90)
+                    file_ids = await FileInfo.filter(
+                        user_id=self.user, upload_at__lt=cutoff
+                    ).values_list("file_id", flat=True)
+                    logger.info(
+                        f"Deleting {len(file_ids)} expired files for user {self.user}..."
                     )
+                    await self._delete_files(file_ids)
+                await self._remove_deleted_files(file_ids)
+
+                return ORJSONResponse(
+                    {"message": "All files not been download for 90 days are deleted"},
+                    status_code=200,
+                )
+            else:
+                return ORJSONResponse(
+                    {"error": "Invalid function parameter"}, status_code=405
+                )
         except Exception as e:
             logger.error(f"Error during batch deletion: {e}")
             raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+@lru_cache(maxsize=1024)
+def get_file_storage(user: str = "") -> FileStorage:
+    # one long-lived instance per user, so its cached user row and folder
+    # check are shared by that user's requests
+    return FileStorage(user)
@@ -0,0 +1,58 @@
+import asyncio
+import io
+import os
+import sys
+from typing import Optional
+
+from loguru import logger
+
+from .env import ENV
+
+
+LOG_BUFFER_SIZE = 64 * 1024
+
+_writer: Optional[io.BufferedWriter] = None
+_handler_id: Optional[int] = None
+_flush_task: Optional[asyncio.Task] = None
+
+
+def _sink(message):
+    # records pile up in the buffer and leave in one write() when it fills or
+    # on the next interval flush; errors go out right away
+    _writer.write(message.encode())
+    if message.record["level"].no >= logger.level("ERROR").no:
+        _writer.flush()
+
+
+async def _flush_loop(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        _writer.flush()
+
+
+def log_setup():
+    """Swap loguru's stderr sink, which writes and flushes every record, for a
+    buffered one flushed every LOG_FLUSH_INTERVAL_MS."""
+    global _writer, _handler_id, _flush_task
+    if ENV.LOG_FLUSH_INTERVAL_MS <= 0:
+        return
+    try:
+        fd = os.dup(sys.stderr.fileno())
+    except (AttributeError, OSError, ValueError):
+        return  # stderr replaced by something without a real descriptor
+
+    _writer = io.BufferedWriter(io.FileIO(fd, "w"), LOG_BUFFER_SIZE)
+    logger.remove()
+    _handler_id = logger.add(_sink, colorize=sys.stderr.isatty())
+    _flush_task = asyncio.create_task(_flush_loop(ENV.LOG_FLUSH_INTERVAL_MS / 1000))
+
+
+def log_close():
+    global _writer, _handler_id, _flush_task
+    if _writer is None:
+        return
+    _flush_task.cancel()
+    logger.remove(_handler_id)
+    logger.add(sys.stderr)
+    _writer.close()  # flushes what is left
+    _writer, _handler_id, _flush_task = None, None, None
@@ -0,0 +1,159 @@
+import hashlib
+import time
+from typing import Dict, List
+
+from loguru import logger
+
+from .env import ENV
+
+
+# A token bucket per client, refilled at REQUEST_TIMES_PER_MINTUE tokens per
+# minute and allowing that many as a burst
+RATE_LIMIT_CAPACITY = float(ENV.REQUEST_TIMES_PER_MINTUE)
+RATE_LIMIT_REFILL = RATE_LIMIT_CAPACITY / 60.0
+# the in-process buckets run on time.monotonic_ns(), integer nanoseconds
+RATE_LIMIT_REFILL_PER_NS = RATE_LIMIT_REFILL / 1_000_000_000
+# an idle bucket is back at capacity after a minute, so it can be dropped
+RATE_LIMIT_IDLE_SECONDS = 120
+
+
+class RateLimitBuckets:
+    """Client key -> [tokens, last_refill_ns]. Idle buckets are swept every
+    `cleanup_interval` seconds (an idle bucket has refilled to capacity, so
+    dropping it changes nothing) and the total is capped, so rotating or
+    spoofed client addresses cannot grow memory without bound."""
+
+    def __init__(
+        self,
+        max_entries: int = 100_000,
+        idle_seconds: float = RATE_LIMIT_IDLE_SECONDS,
+        cleanup_interval: float = 10,
+    ):
+        self.buckets: Dict[str, List[float]] = {}
+        self.max_entries = max_entries
+        self.idle_ns = int(idle_seconds * 1_000_000_000)
+        self.cleanup_interval_ns = int(cleanup_interval * 1_000_000_000)
+        self.last_cleanup = time.monotonic_ns()
+
+    def get(self, client: str, now: int) -> List[float]:
+        if now - self.last_cleanup > self.cleanup_interval_ns:
+            self.last_cleanup = now
+            stale = [
+                key
+                for key, (_, last_refill) in self.buckets.items()
+                if now - last_refill > self.idle_ns
+            ]
+            for key in stale:
+                del self.buckets[key]
+
+        bucket = self.buckets.get(client)
+        if bucket is None:
+            if len(self.buckets) >= self.max_entries:
+                # dicts keep insertion order, so this drops the oldest client
+                del self.buckets[next(iter(self.buckets))]
+            bucket = self.buckets[client] = [RATE_LIMIT_CAPACITY, now]
+        else:
+            bucket[0] = min(
+                RATE_LIMIT_CAPACITY,
+                bucket[0] + (now - bucket[1]) * RATE_LIMIT_REFILL_PER_NS,
+            )
+            bucket[1] = now
+        return bucket
+
+
+# Same refill/consume as RateLimitBuckets, done atomically inside redis and
+# timed by the redis clock so every worker shares one bucket per client.
+# Returns {allowed, tokens}; tokens as a string since lua numbers are
+# truncated to integers on the way out.
+TOKEN_BUCKET_LUA = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local capacity = tonumber(ARGV[1])
+local refill = tonumber(ARGV[2])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * refill)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], ARGV[3])
+return {allowed, tostring(tokens)}
+"""
+
+# seconds between repeated "redis unavailable" warnings
+REDIS_WARNING_INTERVAL = 60
+# a slow or unreachable redis must not hold up every request: calls give up
+# after REDIS_TIMEOUT seconds, and after a failure redis is left alone for
+# REDIS_RETRY_INTERVAL seconds while the local buckets take over
+REDIS_TIMEOUT = 0.25
+REDIS_RETRY_INTERVAL = 5
+
+_buckets = RateLimitBuckets()
+_redis = None
+_token_bucket = None
+_redis_warned_at = 0.0
+_redis_retry_at = 0.0
+
+
+async def rate_limit_connect():
+    """Share the limiter across workers through redis when REDIS_URL is set;
+    otherwise every process keeps its own buckets."""
+    global _redis, _token_bucket
+    if not ENV.REDIS_URL:
+        return
+    # optional dependency, only needed for the shared limiter
+    from redis.asyncio import Redis
+
+    _redis = Redis.from_url(
+        ENV.REDIS_URL,
+        socket_timeout=REDIS_TIMEOUT,
+        socket_connect_timeout=REDIS_TIMEOUT,
+    )
+    _token_bucket = _redis.register_script(TOKEN_BUCKET_LUA)
+
+
+async def rate_limit_close():
+    global _redis, _token_bucket
+    if _redis is not None:
+        await _redis.aclose()
+        _redis = None
+        _token_bucket = None
+
+
+async def take_token(client: str) -> float:
+    """Consume one request for `client`. Returns 0 when allowed, otherwise
+    the seconds until the next token is available."""
+    if len(client) > 128:
+        client = hashlib.sha256(client.encode()).hexdigest()
+
+    global _redis_warned_at, _redis_retry_at
+    if _token_bucket is not None and time.monotonic() >= _redis_retry_at:
+        try:
+            allowed, tokens = await _token_bucket(
+                keys=[f"rl:{client}"],
+                args=[
+                    RATE_LIMIT_CAPACITY,
+                    RATE_LIMIT_REFILL,
+                    RATE_LIMIT_IDLE_SECONDS * 1000,
+                ],
+            )
+            if allowed:
+                return 0
+            return (1 - float(tokens)) / RATE_LIMIT_REFILL
+        except Exception as e:
+            # keep limiting with this worker's own buckets until redis is back
+            now = time.monotonic()
+            _redis_retry_at = now + REDIS_RETRY_INTERVAL
+            if now - _redis_warned_at > REDIS_WARNING_INTERVAL:
+                _redis_warned_at = now
+                logger.warning(f"Rate limit backend unavailable: {e}")
+
+    bucket = _buckets.get(client, time.monotonic_ns())
+    if bucket[0] < 1:
+        return (1 - bucket[0]) / RATE_LIMIT_REFILL
+    bucket[0] -= 1
+    return 0
@@ -5,7 +5,7 @@ from loguru import logger
 from tortoise.exceptions import DoesNotExist
 
 from .database_models import UsersInfo
-from .cache import cache_result, _cache
+from .cache import cache_result, _cache, token_cache
 from .utils import json_datetime_convert
 
 
@@ -16,6 +16,7 @@ class UserManager:
     async def _change_token(self) -> UsersInfo:
         try:
             user = await UsersInfo.get(user=self.user_id)
+            token_cache.invalidate(user.token)
             user.token = str(uuid.uuid4())
             await user.save()
             _cache.invalidate(f"get_user:{self.user_id}")  # Invalidate cache
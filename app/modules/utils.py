@@ -1,12 +1,13 @@
 import datetime
 import secrets
+from zoneinfo import ZoneInfo
 
-from pendulum import instance, timezone
 from tortoise import models
 
+DISPLAY_TIMEZONE = ZoneInfo("Asia/Hong_Kong")
+
 
 def json_datetime_convert(data) -> dict:
-    tz = timezone("Asia/Hong_Kong")
     if hasattr(data, "__dict__"):
         data = {
             key: value
@@ -17,13 +18,24 @@ def json_datetime_convert(data) -> dict:
     # Convert datetime fields to string
     for key, value in data.items():
         if isinstance(value, datetime.datetime):
-            data[key] = tz.convert(instance(value)).to_iso8601_string()
+            if value.tzinfo is None:  # naive values from the db are UTC
+                value = value.replace(tzinfo=datetime.timezone.utc)
+            data[key] = value.astimezone(DISPLAY_TIMEZONE).isoformat()
         elif isinstance(value, models.Model):
             data[key] = json_datetime_convert(value)
 
     return data
 
 
+RANDOM_STRING_POOL = b"ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnprstuvwxyz2345678"
+# byte -> pool character table; bytes past the last full multiple of the pool
+# size are dropped so every character stays equally likely
+_POOL_TABLE = bytes(RANDOM_STRING_POOL[b % len(RANDOM_STRING_POOL)] for b in range(256))
+_POOL_REJECTED = bytes(range(256 - 256 % len(RANDOM_STRING_POOL), 256))
+
+
 def generate_random_string(length: int) -> str:
-    pool = "ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnprstuvwxyz2345678"
-    return "".join(secrets.choice(pool) for _ in range(length))
+    result = b""
+    while len(result) < length:
+        result += secrets.token_bytes(length).translate(_POOL_TABLE, _POOL_REJECTED)
+    return result[:length].decode("ascii")
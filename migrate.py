@@ -1,14 +1,11 @@
-from tortoise import Tortoise
 import asyncio
-from app.modules.env import ENV
+
+from app.modules.database import database_connect, database_close
+
 
 async def migrate():
-    await Tortoise.init(
-        db_url=ENV.DATABASE_URL,
-        modules={'models': ['app.modules.database_models']},
-        _create_db=True
-    )
-    await Tortoise.generate_schemas()
+    await database_connect()
+    await database_close()
 
 if __name__ == "__main__":
     asyncio.run(migrate())
@@ -0,0 +1,46 @@
+import asyncio
+
+from tortoise import Tortoise, connections, timezone as tz
+from tortoise.expressions import F
+
+from app.modules.database_models import UsersInfo
+from app.modules.file_storage import _returning
+
+
+async def run_returning_update(limit, file_size):
+    await Tortoise.init(
+        db_url="sqlite://:memory:",
+        modules={"models": ["app.modules.database_models"]},
+    )
+    try:
+        await Tortoise.generate_schemas()
+        await UsersInfo.create(user="alice", token="alice-token", total_size=100)
+        await UsersInfo.create(user="bob", token="bob-token", total_size=100)
+        # the same shape of update as _update_user_usage("upload"): filter
+        # values mixed with an F() delta and a bound datetime in the SET
+        update = UsersInfo.filter(
+            user="alice", total_size__lte=limit - file_size
+        ).update(
+            total_size=F("total_size") + file_size,
+            total_upload_times=F("total_upload_times") + 1,
+            last_upload_at=tz.now(),
+        )
+        sql, values = _returning(update, "total_size")
+        assert sql.count("?") == len(values)
+        rows = await connections.get("default").execute_query_dict(sql, values)
+        others = await UsersInfo.filter(user="bob").values_list("total_size", flat=True)
+        return rows, others
+    finally:
+        await Tortoise.close_connections()
+
+
+def test_returning_update_binds_values():
+    rows, others = asyncio.run(run_returning_update(limit=1000, file_size=50))
+    assert rows == [{"total_size": 150}]
+    assert others == [100]
+
+
+def test_returning_update_respects_filter():
+    rows, others = asyncio.run(run_returning_update(limit=120, file_size=50))
+    assert rows == []
+    assert others == [100]
@@ -1,6 +1,9 @@
 import pytest
 import io
+import json
 import requests
+from websockets.exceptions import ConnectionClosed
+from websockets.sync.client import connect
 
 @pytest.fixture
 def test_user():
@@ -86,6 +89,20 @@ def test_get_file(monkeypatch, test_user, test_token, test_file):
     assert response.status_code == 200
     assert response.content == test_file["content"]
 
+def test_get_file_html_escapes_name(test_token, test_file):
+    files = {"file": ("<script>.txt", io.BytesIO(test_file["content"]), "text/plain")}
+    headers = {"Authorization": f"Bearer {test_token}"}
+    upload_response = requests.post(
+        "http://localhost:8000/upload",
+        files=files,
+        headers=headers
+    )
+    file_id = upload_response.json()["file_id"]
+    response = requests.get(f"http://localhost:8000/s/{file_id}?output=html")
+    assert response.status_code == 200
+    assert "<script>" not in response.text
+    assert "&lt;script&gt;.txt" in response.text
+
 def test_delete_file(monkeypatch, test_user, test_token, test_file):
     monkeypatch.setattr('app.models.ENV.ALLOWED_USERS', [test_user])
     files = {"file": (test_file["filename"], io.BytesIO(test_file["content"]), "text/plain")}
@@ -112,6 +129,72 @@ def test_delete_all(monkeypatch, test_token ):
     assert response.status_code == 200
     assert response.json()["message"] == "All files deleted"
 
+def test_upload_too_large(test_token):
+    # the declared length alone is enough, the body is never read
+    headers = {"Authorization": f"Bearer {test_token}"}
+    request = requests.Request(
+        "POST",
+        "http://localhost:8000/upload",
+        data=b"x",
+        headers=headers
+    ).prepare()
+    request.headers["Content-Length"] = str(10 * 1024 * 1024 * 1024)
+    with requests.Session() as session:
+        response = session.send(request)
+    assert response.status_code == 413
+
+def test_upload_batch_partial_failure(test_token, test_file):
+    # the second file is over the default FILE_SIZE_LIMIT_MB of 10
+    files = [
+        ("files", (test_file["filename"], io.BytesIO(test_file["content"]), "text/plain")),
+        ("files", ("big.bin", io.BytesIO(b"x" * 11 * 1024 * 1024), "application/octet-stream")),
+    ]
+    headers = {"Authorization": f"Bearer {test_token}"}
+    response = requests.post(
+        "http://localhost:8000/upload_batch",
+        files=files,
+        headers=headers
+    )
+    assert response.status_code == 207
+    saved, failed = response.json()
+    assert "file_id" in saved
+    assert failed["filename"] == "big.bin"
+    assert "status_code" in failed
+    assert "error" in failed
+
+def test_websocket_upload_bearer_header(test_user, test_token, test_file):
+    headers = {"Authorization": f"Bearer {test_token}"}
+    with connect(
+        "ws://localhost:8000/upload_socket", additional_headers=headers
+    ) as websocket:
+        assert websocket.recv() == f"user is: {test_user}"
+        websocket.send(test_file["filename"])
+        websocket.send(test_file["content"])
+        data = json.loads(websocket.recv())
+        assert "file_id" in data
+        assert "file_url" in data
+        # an empty file ends the upload
+        websocket.send("")
+        websocket.send(b"")
+
+def test_websocket_upload_invalid_token():
+    headers = {"Authorization": "Bearer not-a-token"}
+    with connect(
+        "ws://localhost:8000/upload_socket", additional_headers=headers
+    ) as websocket:
+        with pytest.raises(ConnectionClosed) as closed:
+            websocket.recv()
+    assert closed.value.rcvd.code == 1008
+
+# drains this client's rate limit bucket, so it runs last
+def test_rate_limit():
+    for _ in range(1000):
+        response = requests.get("http://localhost:8000/")
+        if response.status_code == 429:
+            break
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
 
 # def test_health():
 #     response = requests.get("http://localhost:8000/health")